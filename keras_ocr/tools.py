@@ -406,6 +406,7 @@ def fit(
     cval: int = 255,
     mode="letterbox",
     return_scale=False,
+    out=None,
 ):
     """Obtain a new image, fit to the specified size.
 
@@ -416,6 +417,9 @@ def fit(
         cval: The constant value to use to fill the remaining areas of
             the image
         return_scale: Whether to return the scale used for the image
+        out: An optional preallocated uint8 array of shape
+            (height, width, 3) into which to write the fitted image,
+            avoiding a fresh allocation per call
 
     Returns:
         The new image
@@ -424,7 +428,11 @@ def fit(
     x_scale = width / image.shape[1]
     y_scale = height / image.shape[0]
     if x_scale == 1 and y_scale == 1:
-        fitted = image
+        if out is None:
+            fitted = image
+        else:
+            np.copyto(out, image)
+            fitted = out
         scale = 1
     elif (x_scale <= y_scale and mode == "letterbox") or (
         x_scale >= y_scale and mode == "crop"
@@ -439,12 +447,20 @@ def fit(
     if fitted is None:
         resize_width, resize_height = map(int, [resize_width, resize_height])
         if mode == "letterbox":
-            fitted = np.zeros((height, width, 3), dtype="uint8") + cval
+            if out is None:
+                fitted = np.zeros((height, width, 3), dtype="uint8")
+            else:
+                fitted = out
+            fitted[:] = cval
             image = cv2.resize(image, dsize=(resize_width, resize_height))
             fitted[: image.shape[0], : image.shape[1]] = image[:height, :width]
         elif mode == "crop":
             image = cv2.resize(image, dsize=(resize_width, resize_height))
-            fitted = image[:height, :width]
+            if out is None:
+                fitted = image[:height, :width]
+            else:
+                np.copyto(out, image[:height, :width])
+                fitted = out
         else:
             raise NotImplementedError(f"Unsupported mode: {mode}")
     if not return_scale:
@@ -458,6 +474,7 @@ def read_and_fit(
     height: int,
     cval: int = 255,
     mode="letterbox",
+    out=None,
 ):
     """Read an image from disk and fit to the specified size.
 
@@ -468,6 +485,7 @@ def read_and_fit(
         cval: The constant value to use to fill the remaining areas of
             the image
         mode: The mode to pass to "fit" (crop or letterbox)
+        out: An optional preallocated output array passed to "fit"
 
     Returns:
         The new image
@@ -477,7 +495,7 @@ def read_and_fit(
         if isinstance(filepath_or_array, str)
         else filepath_or_array
     )
-    image = fit(image=image, width=width, height=height, cval=cval, mode=mode)
+    image = fit(image=image, width=width, height=height, cval=cval, mode=mode, out=out)
     return image
 
 